@@ -1,5 +1,7 @@
 """Configurations for keypoint, skeleton and keypoint jitter sigmas"""
+import functools
 import logging
+import numpy as np
 
 LOG = logging.getLogger(__name__)
 
@@ -9,39 +11,46 @@ coco_std = [0.28863828, 0.27408164, 0.27809835]
 data_mean = [0.485, 0.456, 0.406]
 data_std = [0.229, 0.224, 0.225]
 
-COCO_PERSON_SKELETON = [
+COCO_PERSON_SKELETON = (
     (0, 1), (0, 2), (1, 2), (1, 3), (2, 4), (5, 6), (4, 6), (3, 5),
     (5, 7), (7, 9), (6, 8), (8, 10), (5, 11), (6, 12), (11, 12), (11, 13),
-    (13, 15), (12, 14), (14, 16)]
+    (13, 15), (12, 14), (14, 16))
+COCO_PERSON_SKELETON_ARR = np.asarray(COCO_PERSON_SKELETON, dtype=np.int8)
 
-COCO_PERSON_SKELETON_DOWNUP = [  # after simulation, we get the same results as COCO_PERSON_SKELETON
+COCO_PERSON_SKELETON_DOWNUP = (  # after simulation, we get the same results as COCO_PERSON_SKELETON
     (15, 13), (13, 11), (16, 14), (14, 12), (11, 12), (5, 11), (6, 12),
     (5, 6), (5, 7), (6, 8), (7, 9), (8, 10), (1, 2),
-    (0, 1), (0, 2), (1, 3), (2, 4), (3, 5), (4, 6)]
+    (0, 1), (0, 2), (1, 3), (2, 4), (3, 5), (4, 6))
+COCO_PERSON_SKELETON_DOWNUP_ARR = np.asarray(COCO_PERSON_SKELETON_DOWNUP, dtype=np.int8)
 
-COCO_PERSON_WITH_REDUNDANT_SKELETON = [
+COCO_PERSON_WITH_REDUNDANT_SKELETON = (
     (0, 1), (0, 2), (1, 2), (1, 3), (2, 4), (5, 6), (4, 6), (3, 5),
     (5, 7), (7, 9), (6, 8), (8, 10), (5, 11), (6, 12), (11, 12), (11, 13),
     (13, 15), (12, 14), (14, 16),
     (1, 5), (2, 6), (5, 12), (6, 11), (11, 14), (12, 13),
     (5, 9), (6, 10), (11, 15), (12, 16),
-    (5, 0), (6, 0)]
+    (5, 0), (6, 0))
+COCO_PERSON_WITH_REDUNDANT_SKELETON_ARR = np.asarray(COCO_PERSON_WITH_REDUNDANT_SKELETON, dtype=np.int8)
 
-DENSER_COCO_PERSON_SKELETON = [
+DENSER_COCO_PERSON_SKELETON = (
     (0, 1), (0, 2), (1, 2), (0, 3), (0, 4), (3, 4), (0, 5), (0, 6), (1, 5),
     (2, 6), (1, 3), (2, 4), (3, 5), (4, 6), (5, 6), (5, 11), (6, 12), (5, 12),
     (6, 11), (11, 12), (5, 7), (6, 8), (7, 9), (8, 10), (5, 9), (6, 10), (7, 8),
     (9, 10), (9, 11), (10, 12), (9, 13), (10, 14), (13, 11), (14, 12),
     (11, 14), (12, 13), (11, 15), (12, 16), (15, 13), (16, 14),
-    (13, 16), (14, 15), (13, 14), (15, 16)]
+    (13, 16), (14, 15), (13, 14), (15, 16))
+DENSER_COCO_PERSON_SKELETON_ARR = np.asarray(DENSER_COCO_PERSON_SKELETON, dtype=np.int8)
 
-REDUNDANT_CONNECTIONS = [
+# limbs are directed (offsets point from j1 to j2), so (a, b) and (b, a) are different connections
+_BASE_SKELETON_SET = frozenset(COCO_PERSON_SKELETON)
+REDUNDANT_CONNECTIONS = tuple(
     c
     for c in DENSER_COCO_PERSON_SKELETON
-    if c not in COCO_PERSON_SKELETON
-]
+    if c not in _BASE_SKELETON_SET
+)
+REDUNDANT_CONNECTIONS_ARR = np.asarray(REDUNDANT_CONNECTIONS, dtype=np.int8)
 
-KINEMATIC_TREE_SKELETON = [
+KINEMATIC_TREE_SKELETON = (
     (0, 1), (1, 3),  # left head
     (0, 2), (2, 4),
     (0, 5),
@@ -50,7 +59,8 @@ KINEMATIC_TREE_SKELETON = [
     (6, 8), (8, 10),  # right arm
     (5, 11), (11, 13), (13, 15),  # left side
     (6, 12), (12, 14), (14, 16),
-]
+)
+KINEMATIC_TREE_SKELETON_ARR = np.asarray(KINEMATIC_TREE_SKELETON, dtype=np.int8)
 
 
 COCO_KEYPOINTS = [
@@ -73,8 +83,34 @@ COCO_KEYPOINTS = [
     'right_ankle',  # 16
 ]
 
-LEFT_INDEX = [i for i, v in enumerate(COCO_KEYPOINTS) if v.startswith('l')]
-RIGHT_INDEX = [i for i, v in enumerate(COCO_KEYPOINTS) if v.startswith('r')]
+LEFT_INDEX, RIGHT_INDEX = [], []
+for i, v in enumerate(COCO_KEYPOINTS):  # single pass over the keypoint names
+    if v[0] == 'l':
+        LEFT_INDEX.append(i)
+    elif v[0] == 'r':
+        RIGHT_INDEX.append(i)
+del i, v
+
+
+@functools.lru_cache(maxsize=None)
+def skeleton_csr(skeleton, n_keypoints):
+    """Undirected keypoint adjacency of a (tuple) skeleton in CSR form.
+
+    The neighbors of keypoint i are ``indices[indptr[i]:indptr[i + 1]]``.
+    Results are cached per skeleton, so the returned arrays are read-only.
+    """
+    adjacency = [[] for _ in range(n_keypoints)]
+    for j1, j2 in skeleton:
+        adjacency[j1].append(j2)
+        adjacency[j2].append(j1)
+    indptr = np.cumsum([0] + [len(a) for a in adjacency], dtype=np.int32)
+    indices = np.fromiter((j for row in adjacency for j in row), dtype=np.int32, count=indptr[-1])
+    indptr.flags.writeable = False
+    indices.flags.writeable = False
+    return indptr, indices
+
+
+COCO_SKEL_INDPTR, COCO_SKEL_INDICES = skeleton_csr(COCO_PERSON_SKELETON, len(COCO_KEYPOINTS))
 
 COCO_PERSON_SIGMAS = [
     0.026,  # nose
@@ -116,6 +152,13 @@ HFLIP = {
 }
 
 
+def skeleton_names(keypoints, skeleton):
+    """Gather the (j1, j2) keypoint names of every limb with one fancy-indexing pass."""
+    skeleton = np.asarray(skeleton, dtype=np.intp).reshape(-1, 2)
+    keypoints = np.asarray(keypoints)
+    return list(zip(keypoints[skeleton[:, 0]].tolist(), keypoints[skeleton[:, 1]].tolist()))
+
+
 def heatmap_hflip(keypoints, hflip=None):
     if hflip is None:
         hflip = HFLIP
@@ -130,20 +173,16 @@ def heatmap_hflip(keypoints, hflip=None):
 def offset_hflip(keypoints, skeleton, hflip=None):
     if hflip is None:
         hflip = HFLIP
-    skeleton_names = [
-        (keypoints[j1], keypoints[j2])
-        for j1, j2 in skeleton
-    ]
-
+    limb_names = skeleton_names(keypoints, skeleton)
     flipped_skeleton_names = [
         (hflip[j1] if j1 in hflip else j1, hflip[j2] if j2 in hflip else j2)
-        for j1, j2 in skeleton_names
+        for j1, j2 in limb_names
     ]
-    LOG.debug(f'skeleton = {skeleton_names} \n flipped_skeleton = {flipped_skeleton_names}')
+    LOG.debug(f'skeleton = {limb_names} \n flipped_skeleton = {flipped_skeleton_names}')
 
     flip_indices = list(range(len(skeleton)))
     reserve_indices = []
-    for limb_i, (n1, n2) in enumerate(skeleton_names):
+    for limb_i, (n1, n2) in enumerate(limb_names):
         if (n1, n2) in flipped_skeleton_names:
             flip_indices[limb_i] = flipped_skeleton_names.index((n1, n2))
         if (n2, n1) in flipped_skeleton_names:
@@ -156,19 +195,16 @@ def offset_hflip(keypoints, skeleton, hflip=None):
 def vector_hflip(keypoints, skeleton, hflip=None):
     if hflip is None:
         hflip = HFLIP
-    skeleton_names = [
-        (keypoints[j1], keypoints[j2])
-        for j1, j2 in skeleton
-    ]
+    limb_names = skeleton_names(keypoints, skeleton)
     flipped_skeleton_names = [
         (hflip[j1] if j1 in hflip else j1, hflip[j2] if j2 in hflip else j2)
-        for j1, j2 in skeleton_names
+        for j1, j2 in limb_names
     ]
-    print(f'skeleton = {skeleton_names} \n flipped_skeleton = {flipped_skeleton_names}')
+    print(f'skeleton = {limb_names} \n flipped_skeleton = {flipped_skeleton_names}')
 
     flip_indices = list(range(len(skeleton)))
     reverse_direction = []
-    for limb_i, (n1, n2) in enumerate(skeleton_names):
+    for limb_i, (n1, n2) in enumerate(limb_names):
         if (n1, n2) in flipped_skeleton_names:
             flip_indices[limb_i] = flipped_skeleton_names.index((n1, n2))
         if (n2, n1) in flipped_skeleton_names:
@@ -178,28 +214,36 @@ def vector_hflip(keypoints, skeleton, hflip=None):
     return flip_indices, reverse_direction
 
 
+# hflip permutations of the default COCO configuration, computed once at import
+HEATMAP_HFLIP_IDX = np.asarray(heatmap_hflip(COCO_KEYPOINTS, HFLIP), dtype=np.int8)
+_vector_flip, _vector_reverse = offset_hflip(COCO_KEYPOINTS, COCO_PERSON_SKELETON, HFLIP)
+VECTOR_HFLIP_IDX = np.asarray(_vector_flip, dtype=np.int8)
+VECTOR_HFLIP_REVERSE = np.asarray(_vector_reverse, dtype=np.int8)
+
+
 def draw_skeletons():
-    import numpy as np
     from visualization import show
-    coordinates = np.array([[
-        [0.0, 9.3, 2.0],  # 'nose',
-        [-0.5, 9.7, 2.0],  # 'left_eye',
-        [0.5, 9.7, 2.0],  # 'right_eye',
-        [-1.0, 9.5, 2.0],  # 'left_ear',
-        [1.0, 9.5, 2.0],  # 'right_ear',
-        [-2.0, 8.0, 2.0],  # 'left_shoulder',
-        [2.0, 8.0, 2.0],  # 'right_shoulder',
-        [-2.5, 6.0, 2.0],  # 'left_elbow',
-        [2.5, 6.2, 2.0],  # 'right_elbow',
-        [-2.5, 4.0, 2.0],  # 'left_wrist',
-        [2.5, 4.2, 2.0],  # 'right_wrist',
-        [-1.8, 4.0, 2.0],  # 'left_hip',
-        [1.8, 4.0, 2.0],  # 'right_hip',
-        [-2.0, 2.0, 2.0],  # 'left_knee',
-        [2.0, 2.1, 2.0],  # 'right_knee',
-        [-2.0, 0.0, 2.0],  # 'left_ankle',
-        [2.0, 0.1, 2.0],  # 'right_ankle',
-    ]])
+    coordinates = np.array([
+        [0.0, 9.3],  # 'nose',
+        [-0.5, 9.7],  # 'left_eye',
+        [0.5, 9.7],  # 'right_eye',
+        [-1.0, 9.5],  # 'left_ear',
+        [1.0, 9.5],  # 'right_ear',
+        [-2.0, 8.0],  # 'left_shoulder',
+        [2.0, 8.0],  # 'right_shoulder',
+        [-2.5, 6.0],  # 'left_elbow',
+        [2.5, 6.2],  # 'right_elbow',
+        [-2.5, 4.0],  # 'left_wrist',
+        [2.5, 4.2],  # 'right_wrist',
+        [-1.8, 4.0],  # 'left_hip',
+        [1.8, 4.0],  # 'right_hip',
+        [-2.0, 2.0],  # 'left_knee',
+        [2.0, 2.1],  # 'right_knee',
+        [-2.0, 0.0],  # 'left_ankle',
+        [2.0, 0.1],  # 'right_ankle',
+    ], dtype=np.float32).reshape(1, len(COCO_KEYPOINTS), 2)
+    visibility = np.full((1, len(COCO_KEYPOINTS), 1), 2.0, dtype=np.float32)
+    coordinates = np.concatenate([coordinates, visibility], axis=-1)
 
     keypoint_painter = show.KeypointPainter(show_box=False, color_connections=True,
                                             markersize=1, linewidth=6)
@@ -219,8 +263,7 @@ def draw_skeletons():
 
 def print_associations():
     print('number of limb connections: ', len(COCO_PERSON_SKELETON))
-    for j1, j2 in COCO_PERSON_SKELETON:
-        print(COCO_KEYPOINTS[j1], '-', COCO_KEYPOINTS[j2])
+    print('\n'.join(f'{n1} - {n2}' for n1, n2 in skeleton_names(COCO_KEYPOINTS, COCO_PERSON_SKELETON_ARR)))
 
 
 if __name__ == '__main__':
@@ -230,7 +273,7 @@ if __name__ == '__main__':
     print_associations()
     draw_skeletons()
 
-    print(f'hflip indices of keypoints: {heatmap_hflip(COCO_KEYPOINTS, HFLIP)} \n')
-    vector_hflip(COCO_KEYPOINTS, COCO_PERSON_SKELETON, HFLIP)
+    print(f'hflip indices of keypoints: {HEATMAP_HFLIP_IDX.tolist()} \n')
+    print(f'hflip indices of limbs: {VECTOR_HFLIP_IDX.tolist()} \n reverse: {VECTOR_HFLIP_REVERSE.tolist()}')
     print(REDUNDANT_CONNECTIONS)
     vector_hflip(COCO_KEYPOINTS, COCO_PERSON_WITH_REDUNDANT_SKELETON, HFLIP)
@@ -237,11 +237,8 @@ class LimbsCollect(object):
 
     @staticmethod
     def pack_jtypes(skeleton):
-        jtypes_f, jtypes_t = [], []
-        for i, (j_f, j_t) in enumerate(skeleton):
-            jtypes_f.append(j_f)
-            jtypes_t.append(j_t)
-        return jtypes_f, jtypes_t
+        skeleton = np.asarray(skeleton, dtype=np.intp).reshape(-1, 2)
+        return skeleton[:, 0].tolist(), skeleton[:, 1].tolist()
 
     @staticmethod
     def _channel_dets(dets: tuple, jtypes: list, thresh=0.06) -> tuple:
@@ -44,8 +44,5 @@ def scored_offset(hmp, off, jtypes_f, jtypes_t, kernel_size=7):
 
 
 def pack_jtypes(skeleton):
-    jtypes_f, jtypes_t = [], []
-    for i, (j_f, j_t) in enumerate(skeleton):
-        jtypes_f.append(j_f)
-        jtypes_t.append(j_t)
-    return jtypes_f, jtypes_t
\ No newline at end of file
+    skeleton = np.asarray(skeleton, dtype=np.intp).reshape(-1, 2)
+    return skeleton[:, 0].tolist(), skeleton[:, 1].tolist()
\ No newline at end of file
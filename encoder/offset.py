@@ -115,13 +115,18 @@ class OffsetMapGenerator(object):
 
     def put_connections(self, feature_maps, joints):
 
-        for limb_id, (fr, to) in enumerate(self.skeleton):
-            visible_from = joints[:, fr, 2] > 0  # keypoint is annotated
-            visible_to = joints[:, to, 2] > 0
-            visible = visible_from & visible_to  # only annotated keypoints generate labels!
-
+        skeleton = np.asarray(self.skeleton, dtype=np.intp).reshape(-1, 2)
+        # gather the endpoints of all limbs at once, shape: (N, L, C)
+        joints_fr = joints[:, skeleton[:, 0], :]
+        joints_to = joints[:, skeleton[:, 1], :]
+        # only annotated keypoints generate labels!
+        visible = (joints_fr[..., 2] > 0) & (joints_to[..., 2] > 0)  # (N, L)
+
+        for limb_id, fr in enumerate(skeleton[:, 0].tolist()):
+            limb_visible = visible[:, limb_id]
             self.put_guide_offsets(feature_maps, limb_id,
-                                   joints[visible, fr, :], joints[visible, to, :],
+                                   joints_fr[limb_visible, limb_id, :],
+                                   joints_to[limb_visible, limb_id, :],
                                    fr)
 
     def put_guide_offsets(self, feature_maps, limb_id, joints_fr, joints_to, fr):
@@ -1,6 +1,5 @@
 from . import losses
-from .hourglass_104 import Hourglass104
-from .hourglass_4stage import Hourglass4Stage
 from . import heads
 from . import networks
 from .factory import net_cli, model_factory
+
@@ -14,10 +14,14 @@ def net_cli(parser):
                             'just set it to True if you are not certain')
     group.add_argument('--checkpoint-whole', default=None, type=str,
                        help='the checkpoint path to the whole model (basenet+headnets)')
+    group.add_argument('--compile-mode', default=None, type=str,
+                       choices=['default', 'reduce-overhead', 'max-autotune'],
+                       help='compile the whole model with torch.compile in this mode, '
+                            'reduce-overhead captures the head launches into CUDA graphs')
 
     group = parser.add_argument_group('base network configuration')
     group.add_argument('--basenet', default='hourglass104',
-                       help='base network, e.g. hourglass4stage')
+                       help='base network, e.g. hourglass104')
     group.add_argument('--two-scale', default=False, action='store_true',
                        help='to be implemented')
     group.add_argument('--multi-scale', default=False, action='store_true',
@@ -116,7 +120,7 @@ def model_factory(args):
             args.scale_loss,
             args.sqrt_re)
 
-        model = networks.NetworkWrapper(basenet, headnets)
+        model = networks.NetworkWrapper(basenet, headnets, compile_mode=args.compile_mode)
 
         return model, lossfuncs
 
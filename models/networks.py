@@ -1,13 +1,22 @@
 import logging
 import warnings
 import os
+import pickle
 import sys
 import torch
 import torch.nn as nn
-from models import Hourglass104, Hourglass4Stage
+
+try:
+    from apex.parallel import DistributedDataParallel as ApexDDP
+except ImportError:
+    ApexDDP = None
 
 LOG = logging.getLogger(__name__)
 
+# wrappers whose .module holds the actual network
+PARALLEL_TYPES = (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel) + \
+                 ((ApexDDP,) if ApexDDP is not None else ())
+
 
 def load_model(model, ckpt_path, *, optimizer=None, drop_layers=True, drop_name='offset_convs',
                resume_optimizer=True, optimizer2cuda=True, load_amp=False):
@@ -29,7 +38,7 @@ def load_model(model, ckpt_path, *, optimizer=None, drop_layers=True, drop_name=
     start_epoch = 0
     start_loss = float('inf')
     if not os.path.isfile(ckpt_path):
-        print(f'WARNING!! ##### Current checkpoint file {ckpt_path} DOSE NOT exist!!#####')
+        LOG.warning('##### Current checkpoint file %s DOSE NOT exist!!#####', ckpt_path)
         warnings.warn("No pre-trained parameters are loaded!"
                       " Please make sure you initialize the model randomly!")
         user_choice = input("Are you sure want to continue with randomly model (y/n):\n")
@@ -40,7 +49,21 @@ def load_model(model, ckpt_path, *, optimizer=None, drop_layers=True, drop_name=
         else:
             sys.exit(0)
 
-    checkpoint = torch.load(ckpt_path, map_location=torch.device('cpu'))
+    try:
+        # memory-map the tensors so the pages of dropped layers are never read into RAM
+        checkpoint = torch.load(ckpt_path, map_location=torch.device('cpu'),
+                                mmap=True, weights_only=True)
+    except TypeError:
+        # PyTorch < 2.1 does not support mmap, its default weights_only is False
+        checkpoint = torch.load(ckpt_path, map_location=torch.device('cpu'))
+    except (RuntimeError, pickle.UnpicklingError) as e:
+        # only legacy (non-zipfile) checkpoints and pickled non-tensor objects are retried,
+        # other errors, e.g., truncated or corrupted files, are raised as they are
+        if isinstance(e, RuntimeError) and 'mmap' not in str(e):
+            raise
+        LOG.warning('Fall back to loading the whole checkpoint %s into memory '
+                    'with weights_only=False: %s', ckpt_path, e)
+        checkpoint = torch.load(ckpt_path, map_location=torch.device('cpu'), weights_only=False)
     LOG.info('Loading pre-trained model %s, checkpoint at epoch %d', ckpt_path,
              checkpoint['epoch'])
     start_epoch = checkpoint['epoch'] + 1
@@ -51,24 +74,24 @@ def load_model(model, ckpt_path, *, optimizer=None, drop_layers=True, drop_name=
                  'unskipped steps from checkpoint %s at epoch %d', ckpt_path, start_epoch)
         load_amp = checkpoint['amp']
     else:
-        print(f'No OLD amp state is detected from current checkpoint {ckpt_path} '
-              f'or you do not load amp state')
+        LOG.info('No OLD amp state is detected from current checkpoint %s '
+                 'or you do not load amp state', ckpt_path)
         load_amp = False
 
-    from collections import OrderedDict
-    state_dict = OrderedDict()  # loaded pre-trained model weight
+    state_dict = {}  # loaded pre-trained model weight, dicts keep the insertion order
+
+    # the drop_layers flag is loop-invariant, so resolve the key filter once
+    if drop_layers:
+        skip = lambda k: drop_name in k or 'some_example_convs' in k
+    else:
+        skip = lambda k: False
 
     # convert parallel/distributed model to single model
     for k, v in state_dict_.items():  # Fixme: keep consistent with our model
-        if (drop_name in k or 'some_example_convs' in k) and drop_layers:  #
+        if skip(k):
             continue
-        if k.startswith('module') and not k.startswith('module_list'):
-            name = k[7:]  # remove prefix 'module.'
-            # name = 'module.' + k  # add prefix 'module.'
-            state_dict[name] = v
-        else:
-            name = k
-            state_dict[name] = v
+        # remove prefix 'module.', 'module_list.' is not a parallel prefix
+        state_dict[k[7:] if k.startswith('module.') else k] = v
     model_state_dict = model.state_dict()  # newly built model
 
     # check loaded parameters and created model parameters
@@ -78,6 +101,7 @@ def load_model(model, ckpt_path, *, optimizer=None, drop_layers=True, drop_name=
     msg2 = 'If you see this, your model has more parameters than the ' + \
            'pre-trained weight. Please make sure ' + \
            'you have correctly specified more layers.'
+    # iterate the dicts rather than sets, so the logs and the key order are the same in every run
     for k in state_dict:
         if k in model_state_dict:
             if state_dict[k].shape != model_state_dict[k].shape:
@@ -89,12 +113,13 @@ def load_model(model, ckpt_path, *, optimizer=None, drop_layers=True, drop_name=
         else:
             LOG.debug('Drop pre-trained parameter %s which current model dose '
                       'not have. %s', k, msg1)
-    for k in model_state_dict:
-        if not (k in state_dict):
-            LOG.debug('No param %s in pre-trained model. %s', k, msg2)
-            state_dict[k] = model_state_dict[k]  # append missing params to rescue
+    missing_keys = [k for k in model_state_dict if k not in state_dict]
+    for k in missing_keys:
+        LOG.debug('No param %s in pre-trained model. %s', k, msg2)
+        state_dict[k] = model_state_dict[k]  # append missing params to rescue
     model.load_state_dict(state_dict, strict=False)
-    print(f'Network {model.__class__.__name__} weights have been resumed from checkpoint: {ckpt_path}')
+    LOG.info('Network %s weights have been resumed from checkpoint: %s',
+             model.__class__.__name__, ckpt_path)
 
     # resume optimizer parameters
     if optimizer is not None and resume_optimizer:
@@ -104,32 +129,38 @@ def load_model(model, ckpt_path, *, optimizer=None, drop_layers=True, drop_name=
 
             # Here, we must convert the resumed state data of optimizer to gpu.
             # In this project, we use map_location to map the state tensors to cpu.
+            # optimizer.load_state_dict already casts the states to the device of
+            # their params, so only the states of params still on cpu are left here.
             # In the training process, we need cuda version of state tensors,
             # so we have to convert them to gpu.
             if torch.cuda.is_available() and optimizer2cuda:
                 LOG.debug('Move the optimizer states into GPU.')
+                # copy the remaining cpu states from pinned memory without blocking the host,
+                # the copies are queued on the current stream that later uses them
                 for state in optimizer.state.values():
                     for k, v in state.items():
-                        if torch.is_tensor(v):
-                            state[k] = v.cuda()
+                        if torch.is_tensor(v) and v.device.type == 'cpu':
+                            state[k] = v.pin_memory().to('cuda', non_blocking=True)
 
             # param_group['lr'] will be instead set in a separate fun: adjust_learning_rate()
-            print('Optimizer {} has been resumed from the checkpoint at epoch {}.'
-                  .format(optimizer.__class__.__name__, start_epoch - 1))
+            LOG.info('Optimizer %s has been resumed from the checkpoint at epoch %d.',
+                     optimizer.__class__.__name__, start_epoch - 1)
         elif optimizer is not None:
-            print('Optimizer {} is NOT resumed, although the checkpoint exists.'.format(optimizer.__class__.__name__))
+            LOG.warning('Optimizer %s is NOT resumed, although the checkpoint exists.',
+                        optimizer.__class__.__name__)
         else:
-            print('Optimizer is {}.'.format(optimizer))
+            LOG.info('Optimizer is %s.', optimizer)
     return model, optimizer, start_epoch, start_loss, load_amp
 
 
 def save_model(path, epoch, train_loss, model, optimizer=None, amp_state=None):
-    from apex.parallel import DistributedDataParallel
-    if isinstance(model, (torch.nn.DataParallel, DistributedDataParallel)):
+    if isinstance(model, PARALLEL_TYPES):
         state_dict = model.module.state_dict()  # remove prefix 'module.'
     else:
         state_dict = model.state_dict()
     print(f'Saving {model.__class__.__name__} state dict...')
+    # batch the device-to-host copies up front instead of interleaving them with pickling
+    state_dict = {k: v.detach().cpu() for k, v in state_dict.items()}
 
     data = {'epoch': epoch,
             'train_loss': train_loss,
@@ -140,7 +171,15 @@ def save_model(path, epoch, train_loss, model, optimizer=None, amp_state=None):
     if amp_state is not None:
         print(f'Apex is used, saving all loss_scalers and their corresponding unskipped steps...')
         data['amp'] = amp_state
-    torch.save(data, path)
+    # write to a temporary file first so that an interrupted save never corrupts the old checkpoint
+    tmp_path = path + '.tmp'
+    try:
+        torch.save(data, tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
     print(f'Checkpoint has been saved at {path}')
 
 
@@ -157,26 +196,56 @@ def initialize_weights(model):
     # trick: obtain the class name of this current instance
     print(f"Initialize the weights of {model.__class__.__name__}.")
     for m in model.modules():
-        if isinstance(m, nn.Conv2d):
-            m.weight.data.normal_(0, 0.001)
-            if m.bias is not None:  # bias are not used when we use BN layers
-                m.bias.data.zero_()
-
-        elif isinstance(m, nn.BatchNorm2d):
-            m.weight.data.fill_(1)
-            m.bias.data.zero_()
-
-        elif isinstance(m, nn.Linear):
-            # torch.nn.init.normal_(m.weight.data, 0, 0.01)
-            m.weight.data.normal_(0, 0.01)
-            m.bias.data.zero_()
+        init_fn = _init_fn_of(m)
+        if init_fn is not None:
+            init_fn(m)
     return model
 
 
+def _init_conv(m):
+    nn.init.normal_(m.weight, 0, 0.001)
+    if m.bias is not None:  # bias are not used when we use BN layers
+        nn.init.zeros_(m.bias)
+
+
+def _init_bn(m):
+    nn.init.ones_(m.weight)
+    nn.init.zeros_(m.bias)
+
+
+def _init_linear(m):
+    nn.init.normal_(m.weight, 0, 0.01)
+    nn.init.zeros_(m.bias)
+
+
+_INIT_FNS = {nn.Conv2d: _init_conv,
+             nn.BatchNorm2d: _init_bn,
+             nn.Linear: _init_linear}
+
+
+def _init_fn_of(m):
+    """Dispatch on the exact module type, subclasses fall back to the isinstance chain."""
+    init_fn = _INIT_FNS.get(type(m))
+    if init_fn is not None:
+        return init_fn
+    if isinstance(m, nn.Conv2d):
+        return _init_conv
+    elif isinstance(m, nn.BatchNorm2d):
+        return _init_bn
+    elif isinstance(m, nn.Linear):
+        return _init_linear
+    return None
+
+
 class NetworkWrapper(torch.nn.Module):
-    """Wrap the basenet and headnets into a single module."""
+    """Wrap the basenet and headnets into a single module.
+
+    Args:
+        compile_mode (str): if given, compile the module in-place with torch.compile
+            in this mode, e.g., 'reduce-overhead' captures the per-head launches into CUDA graphs
+    """
 
-    def __init__(self, basenet, headnets):
+    def __init__(self, basenet, headnets, compile_mode=None):
         super(NetworkWrapper, self).__init__()
         self.basenet = basenet
         # Notice!  subnets in list or dict must be warped
@@ -184,12 +253,25 @@ class NetworkWrapper(torch.nn.Module):
         self.headnets = torch.nn.ModuleList(headnets)
         self.head_strides = [hn.stride for hn in headnets]
         self.head_names = [hn.head_name for hn in headnets]
+        # the default configuration (hmp + omp) is unrolled in forward
+        self.two_heads = len(headnets) == 2
         LOG.debug('warp the basnet and headnets into a whole model')
+        if compile_mode is not None:
+            if hasattr(torch.nn.Module, 'compile'):
+                # compile in-place, the state_dict keys stay the same as the eager model
+                self.compile(mode=compile_mode)
+                LOG.info('compile the whole model with torch.compile, mode=%s', compile_mode)
+            else:
+                LOG.warning('torch.compile requires PyTorch >= 2.2, run the model eagerly')
 
     def forward(self, img_tensor):
         # Batch will be divided and Parallel Model will call this forward on every GPU
         feature_tuple = self.basenet(img_tensor)
-        head_outputs = [hn(feature_tuple) for hn in self.headnets]
+        if self.two_heads:
+            head0, head1 = self.headnets
+            head_outputs = [head0(feature_tuple), head1(feature_tuple)]
+        else:
+            head_outputs = [hn(feature_tuple) for hn in self.headnets]
         LOG.debug('final output length of the model: %s ', len(head_outputs))
         return head_outputs
 
@@ -203,8 +285,10 @@ def basenet_factory(basenet_name):
         tuple: BaseNetwork, n_stacks, stride, max_stride, oup_dim
 
     """
-    assert basenet_name in ['hourglass104', 'hourglass4stage'], \
+    assert basenet_name in ['hourglass104'], \
         f'{basenet_name} is not implemented.'
+    # deferred import, only building a base network needs the hourglass definitions
+    from models.hourglass_104 import Hourglass104
 
     if 'hourglass104' in basenet_name:
         model = Hourglass104(None, 2)
@@ -213,13 +297,3 @@ def basenet_factory(basenet_name):
     if 'hourglass52' in basenet_name:
         model = Hourglass104(None, 1)
         return model, 1, 4, 64, 256
-
-    if 'hourglass4stage' in basenet_name:
-        class IMHNOpt:
-            nstack = 4  # stacked number of hourglass
-            hourglass_inp_dim = 256
-            increase = 128  # increased channels once down-sampling through networks
-
-        net_opt = IMHNOpt()
-        out_dim = 50
-        raise Exception('unknown base network in {}'.format(basenet_name))
@@ -6,7 +6,7 @@ import math
 import cv2
 import copy
 import logging
-from config.coco_data import RIGHT_INDEX, LEFT_INDEX
+from config.coco_data import HEATMAP_HFLIP_IDX
 
 LOG = logging.getLogger(__name__)
 
@@ -202,15 +202,10 @@ class WarpAffineTransforms(Preprocess):
 
         # we must flip the keypoint channels accordingly.
         if self.flip:
-            assert len(RIGHT_INDEX) == len(LEFT_INDEX), 'check left and right body keypoints'
-            tmp_left = anns[:, LEFT_INDEX, :]
-            tmp_right = anns[:, RIGHT_INDEX, :]
-            # swap the left and right
-            anns[:, LEFT_INDEX, :] = tmp_right
-            anns[:, RIGHT_INDEX, :] = tmp_left
+            # swap the left and right with the cached hflip permutation (a single gather)
+            anns[:] = anns[:, HEATMAP_HFLIP_IDX, :]
             LOG.debug('flip left and right keypoints during augmentation')
-            meta['joint_channel_ind'][LEFT_INDEX] = RIGHT_INDEX
-            meta['joint_channel_ind'][RIGHT_INDEX] = LEFT_INDEX
+            meta['joint_channel_ind'] = meta['joint_channel_ind'][HEATMAP_HFLIP_IDX]
 
         # crop the keypoints beyond the image boarder
         for i, p in enumerate(anns):